@@ -1 +1,50 @@
-response_cache = {}
\ No newline at end of file
+import numpy as np
+
+from core.embeddings import VECTOR_SIZE
+
+response_cache = {}
+
+
+class SemanticCache:
+    """
+    Answer cache keyed by question embedding. A lookup hits when the cosine
+    similarity to a cached question exceeds the threshold, so rephrasings like
+    "What is X?" / "what is x" share an entry. Embeddings are L2-normalized,
+    so the inner product is the cosine.
+
+    Holds at most max_entries answers in a fixed ring buffer; once full, the
+    oldest entry is overwritten, which also bounds the per-lookup scan.
+    """
+
+    def __init__(self, dim: int = VECTOR_SIZE, threshold: float = 0.97, max_entries: int = 1024):
+        self.dim = dim
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.clear()
+
+    def lookup(self, vector) -> str | None:
+        if not self._answers:
+            return None
+        q = np.asarray(vector, dtype=np.float32)
+        sims = self._vectors[: len(self._answers)] @ q
+        best = int(np.argmax(sims))
+        if sims[best] > self.threshold:
+            return self._answers[best]
+        return None
+
+    def add(self, vector, answer: str):
+        slot = self._next
+        self._vectors[slot] = np.asarray(vector, dtype=np.float32)
+        if slot < len(self._answers):
+            self._answers[slot] = answer
+        else:
+            self._answers.append(answer)
+        self._next = (slot + 1) % self.max_entries
+
+    def clear(self):
+        self._vectors = np.empty((self.max_entries, self.dim), dtype=np.float32)
+        self._answers: list[str] = []
+        self._next = 0
+
+
+semantic_cache = SemanticCache()
@@ -1,7 +1,117 @@
-from langchain_community.embeddings import HuggingFaceEmbeddings
+import os
+from abc import abstractmethod
+from pathlib import Path
 
-embeddings = HuggingFaceEmbeddings(
-    model_name="sentence-transformers/all-MiniLM-L6-v2"
-)
+import numpy as np
+import torch
+from langchain_core.embeddings import Embeddings
+from sentence_transformers import SentenceTransformer
 
-VECTOR_SIZE = 384  # Dimension of all-MiniLM-L6-v2
\ No newline at end of file
+MODEL_NAME = "sentence-transformers/all-MiniLM-L6-v2"
+VECTOR_SIZE = 384  # Dimension of all-MiniLM-L6-v2
+
+# Quantized ONNX export is written here once and reused on later startups
+ONNX_CACHE_DIR = Path(__file__).resolve().parent.parent / ".onnx_cache" / "all-MiniLM-L6-v2-int8"
+
+# PyTorch defaults to fewer intra-op threads than cores on some hosts
+torch.set_num_threads(os.cpu_count() or 1)
+
+
+class NumpyEmbeddings(Embeddings):
+    """
+    Embeddings backed by an `encode(texts) -> float32 ndarray` method.
+    Hot paths use encode_query to keep vectors as NumPy instead of boxing
+    each component into a Python float.
+    """
+
+    @abstractmethod
+    def encode(self, texts: list[str]) -> np.ndarray:
+        """Embed texts into a (len(texts), VECTOR_SIZE) float32 array."""
+
+    def encode_query(self, text: str) -> np.ndarray:
+        return self.encode([text])[0]
+
+    def embed_documents(self, texts: list[str]) -> list[list[float]]:
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> list[float]:
+        return self.encode_query(text).tolist()
+
+
+class OnnxMiniLMEmbeddings(NumpyEmbeddings):
+    """MiniLM served through ONNX Runtime with dynamic INT8 quantization (CPU)."""
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: int = 64):
+        from optimum.onnxruntime import ORTModelForFeatureExtraction, ORTQuantizer
+        from optimum.onnxruntime.configuration import AutoQuantizationConfig
+        from transformers import AutoTokenizer
+
+        self.batch_size = batch_size
+        self.tokenizer = AutoTokenizer.from_pretrained(model_name)
+
+        if not (ONNX_CACHE_DIR / "model_quantized.onnx").exists():
+            model = ORTModelForFeatureExtraction.from_pretrained(
+                model_name, export=True, provider="CPUExecutionProvider"
+            )
+            quantizer = ORTQuantizer.from_pretrained(model)
+            quantizer.quantize(
+                save_dir=ONNX_CACHE_DIR,
+                quantization_config=AutoQuantizationConfig.avx512_vnni(is_static=False),
+            )
+
+        self.model = ORTModelForFeatureExtraction.from_pretrained(
+            ONNX_CACHE_DIR,
+            file_name="model_quantized.onnx",
+            provider="CPUExecutionProvider",
+        )
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        out = np.empty((len(texts), VECTOR_SIZE), dtype=np.float32)
+        for start in range(0, len(texts), self.batch_size):
+            batch = texts[start : start + self.batch_size]
+            inputs = self.tokenizer(
+                batch, padding=True, truncation=True, max_length=256, return_tensors="np"
+            )
+            hidden = self.model(**inputs).last_hidden_state
+            hidden = np.asarray(hidden, dtype=np.float32)
+
+            # Mean pooling over real (non-padding) tokens, then L2 normalize
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+            pooled /= np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+            out[start : start + len(batch)] = pooled
+        return out
+
+
+class SentenceTransformerEmbeddings(NumpyEmbeddings):
+    """MiniLM via SentenceTransformer.encode, batched and returning NumPy directly."""
+
+    def __init__(self, model_name: str = MODEL_NAME, batch_size: int = 64):
+        self.batch_size = batch_size
+        self.model = SentenceTransformer(
+            model_name, device="cuda" if torch.cuda.is_available() else "cpu"
+        )
+
+    def encode(self, texts: list[str]) -> np.ndarray:
+        return self.model.encode(
+            texts,
+            batch_size=self.batch_size,
+            normalize_embeddings=True,
+            convert_to_numpy=True,
+            show_progress_bar=False,
+        ).astype(np.float32, copy=False)
+
+
+def _load_embeddings() -> NumpyEmbeddings:
+    # GPU hosts keep the PyTorch model; CPU hosts get the quantized ONNX graph
+    if not torch.cuda.is_available():
+        try:
+            return OnnxMiniLMEmbeddings()
+        except Exception as e:
+            print(f"⚠️  ONNX embedder unavailable, falling back to PyTorch: {e}")
+    return SentenceTransformerEmbeddings()
+
+
+# Module-level singleton: the MiniLM weights load once per process and are
+# shared by ingestion and retrieval.
+embeddings = _load_embeddings()
@@ -1,4 +1,4 @@
-from qdrant_client import QdrantClient
+from qdrant_client import AsyncQdrantClient, QdrantClient
 from core.config import QDRANT_URL, QDRANT_API_KEY
 
 qdrant = QdrantClient(
@@ -6,4 +6,12 @@ qdrant = QdrantClient(
     api_key=QDRANT_API_KEY,
     timeout=60,
     prefer_grpc=False,
-)
\ No newline at end of file
+)
+
+# Async client for the chat hot path so per-collection queries run concurrently
+async_qdrant = AsyncQdrantClient(
+    url=QDRANT_URL,
+    api_key=QDRANT_API_KEY,
+    timeout=60,
+    prefer_grpc=False,
+)
@@ -1,10 +1,32 @@
+import hashlib
+import queue
 import uuid
-from langchain_community.document_loaders import PyPDFLoader
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Iterator
+
+import numpy as np
+import pypdfium2 as pdfium
+from langchain_core.documents import Document
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from qdrant_client.models import VectorParams, Distance, PointStruct
+from qdrant_client.models import (
+    Distance,
+    FieldCondition,
+    Filter,
+    MatchValue,
+    PayloadSchemaType,
+    PointIdsList,
+    PointStruct,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+)
+from transformers import AutoTokenizer
 
-from core.embeddings import embeddings, VECTOR_SIZE
+from core.embeddings import embeddings, MODEL_NAME, VECTOR_SIZE
 from core.qdrant_client import qdrant
+from retrieval import bm25_index
 
 
 COLLECTIONS = [
@@ -15,56 +37,281 @@ COLLECTIONS = [
 ]
 
 
+# Namespace for deterministic point ids, so re-uploading a file overwrites its points
+POINT_ID_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, "rag-system/chunks")
+
+# INT8 vectors kept in RAM; retrieval rescores with the originals
+QUANTIZATION_CONFIG = ScalarQuantization(
+    scalar=ScalarQuantizationConfig(
+        type=ScalarType.INT8,
+        quantile=0.99,
+        always_ram=True,
+    ),
+)
+
+# Existing collections already checked for index/quantization config in this process
+_configured: set[str] = set()
+
+
+def _configure_existing(name: str):
+    """Bring a collection created by an older version up to the current config."""
+    info = qdrant.get_collection(name)
+    if "file_hash" not in (info.payload_schema or {}):
+        qdrant.create_payload_index(
+            collection_name=name,
+            field_name="file_hash",
+            field_schema=PayloadSchemaType.KEYWORD,
+        )
+    if info.config.quantization_config is None:
+        qdrant.update_collection(
+            collection_name=name,
+            quantization_config=QUANTIZATION_CONFIG,
+        )
+
+
 def ensure_collections():
-    """Create Qdrant collections if they don't exist."""
+    """Create Qdrant collections if they don't exist, and upgrade existing ones once."""
     existing = [c.name for c in qdrant.get_collections().collections]
     for name in COLLECTIONS:
-        if name not in existing:
+        if name in existing:
+            if name not in _configured:
+                _configure_existing(name)
+                _configured.add(name)
+        else:
             qdrant.create_collection(
                 collection_name=name,
                 vectors_config=VectorParams(
                     size=VECTOR_SIZE,
                     distance=Distance.COSINE,
                 ),
+                quantization_config=QUANTIZATION_CONFIG,
+            )
+            # Indexed so duplicate-upload checks stay a cheap filtered count
+            qdrant.create_payload_index(
+                collection_name=name,
+                field_name="file_hash",
+                field_schema=PayloadSchemaType.KEYWORD,
             )
     return existing
 
 
-def ingest_pdf(file_path: str, collection: str = "research_papers"):
+def file_md5(file_path: str) -> str:
+    digest = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _file_filter(file_hash: str) -> Filter:
+    return Filter(must=[FieldCondition(key="file_hash", match=MatchValue(value=file_hash))])
+
+
+def count_ingested(collection: str, file_hash: str) -> int:
+    """
+    Number of chunks stored for a file's content hash if that upload completed,
+    otherwise 0. Each point records the file's total chunk count.
+    """
+    try:
+        file_filter = _file_filter(file_hash)
+        stored = qdrant.count(
+            collection_name=collection,
+            count_filter=file_filter,
+            exact=True,
+        ).count
+        if not stored:
+            return 0
+
+        sample, _ = qdrant.scroll(
+            collection_name=collection,
+            scroll_filter=file_filter,
+            limit=1,
+            with_payload=["file_chunks"],
+            with_vectors=False,
+        )
+        expected = sample[0].payload.get("file_chunks") if sample else None
+        if expected is None or stored < expected:
+            return 0
+        return stored
+    except Exception:
+        # Can't tell: re-ingest, which is an idempotent upsert
+        return 0
+
+
+# Chunks accumulated before an embedding pass; large enough that length-sorting
+# inside the window still groups similar lengths into each batch of 64
+EMBED_WINDOW = 256
+
+# Token budgets for chunking: split at 200 MiniLM tokens, then merge
+# neighbours below 100 tokens as long as the result stays within 220
+# (under the model's 256-token window, so nothing is truncated)
+CHUNK_TOKENS = 200
+CHUNK_OVERLAP_TOKENS = 20
+MIN_CHUNK_TOKENS = 100
+MAX_MERGED_TOKENS = 220
+
+# End-of-stream marker for the ingestion pipeline queues
+_DONE = object()
+
+
+def iter_pdf_pages(file_path: str) -> Iterator[Document]:
+    """Yield one Document per PDF page using the native PDFium parser."""
+    pdf = pdfium.PdfDocument(file_path)
+    try:
+        for i in range(len(pdf)):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            yield Document(
+                page_content=textpage.get_text_range(),
+                metadata={"source": file_path, "page": i},
+            )
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+
+
+@lru_cache(maxsize=1)
+def get_tokenizer():
+    return AutoTokenizer.from_pretrained(MODEL_NAME)
+
+
+def merge_small_chunks(page_text: str, chunks: list[Document], tokenizer) -> list[Document]:
+    """
+    Fold tiny chunks into their neighbour when the merged chunk fits the token cap.
+    A merged chunk is re-sliced from the page text (the splitter records each
+    chunk's start_index), so the splitter's overlap is never repeated or lost.
+    """
+    merged: list[Document] = []
+    merged_tokens: list[int] = []
+    for chunk in chunks:
+        text = chunk.page_content
+        n_tokens = len(tokenizer.tokenize(text))
+        start = chunk.metadata.get("start_index", -1)
+        if merged and (n_tokens < MIN_CHUNK_TOKENS or merged_tokens[-1] < MIN_CHUNK_TOKENS):
+            prev = merged[-1]
+            prev_start = prev.metadata.get("start_index", -1)
+            if 0 <= prev_start <= start:
+                merged_text = page_text[prev_start:start + len(text)]
+                merged_n_tokens = len(tokenizer.tokenize(merged_text))
+                if merged_n_tokens <= MAX_MERGED_TOKENS:
+                    prev.page_content = merged_text
+                    merged_tokens[-1] = merged_n_tokens
+                    continue
+        merged.append(chunk)
+        merged_tokens.append(n_tokens)
+    return merged
+
+
+def _parse_pages(file_path: str, page_q: queue.Queue):
+    try:
+        for page in iter_pdf_pages(file_path):
+            page_q.put(page)
+    finally:
+        page_q.put(_DONE)
+
+
+def _split_pages(splitter, tokenizer, page_q: queue.Queue, chunk_q: queue.Queue):
+    try:
+        while (page := page_q.get()) is not _DONE:
+            chunks = splitter.split_documents([page])
+            for chunk in merge_small_chunks(page.page_content, chunks, tokenizer):
+                chunk_q.put(chunk)
+    finally:
+        chunk_q.put(_DONE)
+
+
+def embed_length_sorted(texts: list[str], batch_size: int = 64) -> np.ndarray:
+    """
+    Embed texts in length-sorted batches so each batch pads to a similar length,
+    then restore the original order.
+    """
+    order = np.argsort([len(t) for t in texts], kind="stable")
+    sorted_texts = [texts[i] for i in order]
+
+    vectors = np.empty((len(texts), VECTOR_SIZE), dtype=np.float32)
+    for i in range(0, len(sorted_texts), batch_size):
+        batch_idx = order[i : i + batch_size]
+        vectors[batch_idx] = embeddings.encode(sorted_texts[i : i + batch_size])
+    return vectors
+
+
+def ingest_pdf(file_path: str, collection: str = "research_papers") -> tuple[int, bool]:
     """
     Load a PDF, split into chunks, embed, and upsert into Qdrant.
-    Returns the number of chunks ingested.
+    Returns the number of chunks stored and whether the file was already ingested.
     """
+    # Only the known collections exist in Qdrant; check before touching disk
+    if collection not in COLLECTIONS:
+        raise ValueError(f"Unknown collection: {collection}")
+
     # Ensure collections exist
     ensure_collections()
 
-    # Load PDF
-    loader = PyPDFLoader(file_path)
-    data = loader.load()
+    # Same PDF fully ingested into this collection: skip parsing and embedding
+    file_hash = file_md5(file_path)
+    existing = count_ingested(collection, file_hash)
+    if existing:
+        return existing, True
 
-    # Split into chunks
-    splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1000,
-        chunk_overlap=200,
+    # Token-aware splitting with the embedding model's own tokenizer
+    tokenizer = get_tokenizer()
+    splitter = RecursiveCharacterTextSplitter.from_huggingface_tokenizer(
+        tokenizer,
+        chunk_size=CHUNK_TOKENS,
+        chunk_overlap=CHUNK_OVERLAP_TOKENS,
+        add_start_index=True,
     )
-    chunks = splitter.split_documents(data)
+
+    # Pipeline: one thread parses pages, one splits them, and this thread
+    # embeds chunks window by window while parsing is still running
+    page_q: queue.Queue = queue.Queue()
+    chunk_q: queue.Queue = queue.Queue()
+    chunks = []
+    vector_parts = []
+    embedded = 0
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        parse_future = pool.submit(_parse_pages, file_path, page_q)
+        split_future = pool.submit(_split_pages, splitter, tokenizer, page_q, chunk_q)
+
+        while (chunk := chunk_q.get()) is not _DONE:
+            chunks.append(chunk)
+            if len(chunks) - embedded >= EMBED_WINDOW:
+                vector_parts.append(
+                    embed_length_sorted([c.page_content for c in chunks[embedded:]])
+                )
+                embedded = len(chunks)
+
+        # Re-raise any parse/split failure
+        parse_future.result()
+        split_future.result()
 
     if not chunks:
-        return 0
+        return 0, False
 
-    # Embed all chunks
+    if embedded < len(chunks):
+        vector_parts.append(embed_length_sorted([c.page_content for c in chunks[embedded:]]))
+    vectors = np.concatenate(vector_parts)
     texts = [chunk.page_content for chunk in chunks]
-    vectors = embeddings.embed_documents(texts)
+
+    # Extend the collection-wide BM25 index, keyed by point id, so queries
+    # don't have to rebuild it. It is only saved once every point is stored.
+    point_ids = [str(uuid.uuid5(POINT_ID_NAMESPACE, f"{file_hash}:{i}")) for i in range(len(chunks))]
+    bm25 = bm25_index.extend(collection, texts, point_ids)
 
     # Build Qdrant points
     points = [
         PointStruct(
-            id=str(uuid.uuid4()),
-            vector=vectors[i],
+            id=point_ids[i],
+            vector=vectors[i].tolist(),
             payload={
                 "text": chunks[i].page_content,
+                "tokens": bm25_index.tokenize(chunks[i].page_content),
                 "page": chunks[i].metadata.get("page", 0),
                 "source_file": file_path,
+                "file_hash": file_hash,
+                "file_chunks": len(chunks),
                 "collection": collection,
             },
         )
@@ -73,8 +320,21 @@ def ingest_pdf(file_path: str, collection: str = "research_papers"):
 
     # Upsert in batches of 100
     batch_size = 100
-    for i in range(0, len(points), batch_size):
-        batch = points[i : i + batch_size]
-        qdrant.upsert(collection_name=collection, points=batch)
+    try:
+        for i in range(0, len(points), batch_size):
+            batch = points[i : i + batch_size]
+            qdrant.upsert(collection_name=collection, points=batch)
+    except Exception:
+        # Best effort: drop the partial upload so no point refers to unsaved BM25 rows
+        try:
+            qdrant.delete(
+                collection_name=collection,
+                points_selector=PointIdsList(points=[p.id for p in points]),
+            )
+        except Exception:
+            pass
+        raise
+
+    bm25_index.save(collection, bm25)
 
-    return len(points)
+    return len(points), False
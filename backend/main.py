@@ -12,9 +12,10 @@ from pydantic import BaseModel
 from retrieval.planner import planner
 from retrieval.retriever import hybrid_retrieve
 from core.llm import llm
-from cache.cache import response_cache
+from core.embeddings import embeddings
+from cache.cache import response_cache, semantic_cache
 from memory.memory import chat_memory
-from ingestion.ingestion import ingest_pdf, ensure_collections
+from ingestion.ingestion import COLLECTIONS, ingest_pdf, ensure_collections
 
 
 @asynccontextmanager
@@ -113,6 +114,11 @@ async def upload_pdf(
     """Upload a PDF file and ingest it into a Qdrant collection."""
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
+    if collection not in COLLECTIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown collection '{collection}'. Choose one of: {', '.join(COLLECTIONS)}",
+        )
 
     # Save to temp file
     temp_dir = tempfile.mkdtemp()
@@ -124,13 +130,18 @@ async def upload_pdf(
             f.write(content)
 
         # Ingest into Qdrant
-        chunks_count = ingest_pdf(temp_path, collection)
+        chunks_count, already_ingested = ingest_pdf(temp_path, collection)
+
+        if already_ingested:
+            message = f"{file.filename} was already ingested ({chunks_count} chunks)"
+        else:
+            message = f"Successfully ingested {chunks_count} chunks from {file.filename}"
 
         return UploadResponse(
             filename=file.filename,
             chunks_ingested=chunks_count,
             collection=collection,
-            message=f"Successfully ingested {chunks_count} chunks from {file.filename}",
+            message=message,
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ingestion failed: {str(e)}")
@@ -148,15 +159,21 @@ async def chat(request: ChatRequest):
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
 
-    # Check cache
+    # Check cache (exact match first, then near-duplicate questions)
     if question in response_cache:
         return {"answer": response_cache[question], "cached": True}
 
+    # Embed once: shared by the semantic cache and retrieval
+    question_vec = embeddings.encode_query(question)
+    cached_answer = semantic_cache.lookup(question_vec)
+    if cached_answer is not None:
+        return {"answer": cached_answer, "cached": True}
+
     # Plan which collections to search (Fast Keyword Routing)
     selected = planner(question)
 
     # Hybrid retrieval (vector search + BM25 reranking)
-    docs = await hybrid_retrieve(question, selected)
+    docs = await hybrid_retrieve(question, selected, question_vec=question_vec)
 
     # Build context
     context = "\n\n".join(docs) if docs else "No relevant documents found."
@@ -186,21 +203,24 @@ User Question:
     # Stream response
     async def generate():
         full_response = ""
+        completed = False
         try:
-            response = llm.stream(prompt)
-            for chunk in response:
+            async for chunk in llm.astream(prompt):
                 if chunk.content:
                     full_response += chunk.content
                     yield chunk.content
+            completed = True
         except Exception as e:
             error_msg = f"\n\n[Error generating response: {str(e)}]"
             yield error_msg
             full_response += error_msg
         finally:
-            # Update memory and cache
+            # Update memory; cache only answers that streamed to the end
             if full_response:
                 chat_memory.update(session_id, question, full_response)
+            if completed and full_response:
                 response_cache[question] = full_response
+                semantic_cache.add(question_vec, full_response)
 
     return StreamingResponse(generate(), media_type="text/plain")
 
@@ -217,4 +237,5 @@ async def clear_all_memory():
     """Clear all chat memory."""
     chat_memory.clear_all()
     response_cache.clear()
+    semantic_cache.clear()
     return {"message": "All memory and cache cleared"}
\ No newline at end of file
@@ -1,29 +1,50 @@
-from collections import defaultdict
+from collections import deque
+
+
+class _Session:
+    """Formatted turns for one session plus the joined prompt fragment."""
+
+    __slots__ = ("turns", "chars", "formatted")
+
+    def __init__(self, max_turns: int):
+        self.turns: deque[str] = deque(maxlen=max_turns)
+        self.chars = 0
+        self.formatted = ""
 
 
 class ChatMemory:
-    """Simple in-memory chat history, keyed by session_id."""
+    """
+    Simple in-memory chat history, keyed by session_id.
+    Each session keeps its last N turns already formatted, so format_history
+    is a field read instead of a rebuild on every request.
+    """
 
-    def __init__(self, max_turns: int = 10):
+    def __init__(self, max_turns: int = 10, max_chars: int = 8000):
         self.max_turns = max_turns
-        self._store: dict[str, list[dict]] = defaultdict(list)
+        self.max_chars = max_chars
+        self._store: dict[str, _Session] = {}
 
     def update(self, session_id: str, user_msg: str, assistant_msg: str):
-        history = self._store[session_id]
-        history.append({"user": user_msg, "assistant": assistant_msg})
+        session = self._store.get(session_id)
+        if session is None:
+            session = self._store[session_id] = _Session(self.max_turns)
+
         # Keep only the last N turns
-        if len(history) > self.max_turns:
-            self._store[session_id] = history[-self.max_turns :]
+        if len(session.turns) == self.max_turns:
+            session.chars -= len(session.turns[0])
+        turn = f"User: {user_msg}\nAssistant: {assistant_msg}\n\n"
+        session.turns.append(turn)
+        session.chars += len(turn)
+
+        # Bound prompt size, always keeping the latest turn
+        while session.chars > self.max_chars and len(session.turns) > 1:
+            session.chars -= len(session.turns.popleft())
+
+        session.formatted = "".join(session.turns)
 
     def format_history(self, session_id: str) -> str:
-        history = self._store.get(session_id, [])
-        if not history:
-            return ""
-        formatted = ""
-        for turn in history:
-            formatted += f"User: {turn['user']}\n"
-            formatted += f"Assistant: {turn['assistant']}\n\n"
-        return formatted
+        session = self._store.get(session_id)
+        return session.formatted if session else ""
 
     def clear(self, session_id: str):
         self._store.pop(session_id, None)
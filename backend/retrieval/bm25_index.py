@@ -0,0 +1,242 @@
+import os
+import pickle
+import re
+import threading
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+import scipy.sparse as sp
+
+from core.qdrant_client import qdrant
+
+# Per-collection BM25 indexes are cached next to the backend, one pickle per
+# collection. The disk is not persistent on every host, so Qdrant (whose payloads
+# carry each chunk's tokens) is the source of truth and a missing or unreadable
+# pickle is rebuilt from it.
+BM25_DIR = Path(__file__).resolve().parent.parent / ".bm25"
+
+# Okapi parameters (same defaults as rank_bm25)
+K1 = 1.5
+B = 0.75
+EPSILON = 0.25
+
+_word_re = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return _word_re.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Okapi BM25 over a sparse term-frequency matrix (documents x vocabulary).
+    Scoring a set of documents is a sparse slice plus a few vectorized NumPy ops.
+    Rows can optionally be keyed by Qdrant point id.
+    """
+
+    def __init__(self):
+        self.point_ids: list[str] = []
+        self.rows: dict[str, int] = {}
+        self.vocab: dict[str, int] = {}
+        self.tf = sp.csr_matrix((0, 0), dtype=np.float32)
+        self.doc_len = np.empty(0, dtype=np.float32)
+        self._refresh_stats()
+
+    @classmethod
+    def from_tokens(cls, token_lists: list[list[str]]) -> "BM25Index":
+        index = cls()
+        index.add(token_lists)
+        return index
+
+    def __len__(self) -> int:
+        return self.tf.shape[0]
+
+    def add(self, token_lists: list[list[str]], point_ids: list[str] | None = None) -> list[int]:
+        """Append documents and refresh IDF statistics. Returns their row indices."""
+        start = len(self)
+        if point_ids is not None:
+            for offset, point_id in enumerate(point_ids):
+                self.rows[point_id] = start + offset
+            self.point_ids.extend(point_ids)
+
+        indptr = [0]
+        indices: list[int] = []
+        data: list[int] = []
+        for tokens in token_lists:
+            for term, count in Counter(tokens).items():
+                indices.append(self.vocab.setdefault(term, len(self.vocab)))
+                data.append(count)
+            indptr.append(len(indices))
+
+        new_tf = sp.csr_matrix(
+            (
+                np.array(data, dtype=np.float32),
+                np.array(indices, dtype=np.int32),
+                np.array(indptr, dtype=np.int64),
+            ),
+            shape=(len(token_lists), len(self.vocab)),
+        )
+        old_tf = self.tf.copy()
+        old_tf.resize((len(self), len(self.vocab)))
+        self.tf = sp.vstack([old_tf, new_tf], format="csr")
+        self.doc_len = np.concatenate(
+            [self.doc_len, np.array([len(t) for t in token_lists], dtype=np.float32)]
+        )
+        self._refresh_stats()
+        return list(range(start, len(self)))
+
+    def _refresh_stats(self):
+        n_docs = len(self)
+        self.avgdl = float(self.doc_len.mean()) if n_docs else 0.0
+
+        df = np.bincount(self.tf.indices, minlength=len(self.vocab)).astype(np.float32)
+        idf = np.log(n_docs - df + 0.5) - np.log(df + 0.5)
+        if len(idf):
+            # Common terms get a small positive floor instead of a negative weight
+            idf[idf < 0] = EPSILON * idf.mean()
+        self.idf = idf.astype(np.float32)
+
+    def scores(self, query_tokens: list[str], doc_indices: list[int] | None = None) -> np.ndarray:
+        """BM25 scores for the given rows (all rows if None)."""
+        rows = np.arange(len(self)) if doc_indices is None else np.asarray(doc_indices)
+        q_idx = [self.vocab[t] for t in query_tokens if t in self.vocab]
+        if not q_idx or not len(rows):
+            return np.zeros(len(rows), dtype=np.float32)
+
+        tf = self.tf[rows][:, q_idx].toarray()
+        norm = K1 * (1 - B + B * self.doc_len[rows] / self.avgdl)
+        return (self.idf[q_idx] * tf * (K1 + 1) / (tf + norm[:, None])).sum(axis=1)
+
+    def copy(self) -> "BM25Index":
+        """Independent copy that can be extended without touching this index."""
+        clone = BM25Index.__new__(BM25Index)
+        clone.__setstate__(
+            {**self.__getstate__(), "vocab": dict(self.vocab), "point_ids": list(self.point_ids)}
+        )
+        return clone
+
+    def __getstate__(self):
+        return {
+            "point_ids": self.point_ids,
+            "vocab": self.vocab,
+            "tf": self.tf,
+            "doc_len": self.doc_len,
+        }
+
+    def __setstate__(self, state):
+        self.point_ids = state["point_ids"]
+        self.rows = {point_id: row for row, point_id in enumerate(self.point_ids)}
+        self.vocab = state["vocab"]
+        self.tf = state["tf"]
+        self.doc_len = state["doc_len"]
+        self._refresh_stats()
+
+
+# collection -> (file mtime, index)
+_cache: dict[str, tuple[float, BM25Index]] = {}
+
+# Serializes loads and rebuilds so concurrent requests don't scroll a collection twice
+_lock = threading.Lock()
+
+
+def _index_path(collection: str) -> Path:
+    # Collection names become file names: refuse anything that could leave BM25_DIR
+    if not collection or Path(collection).name != collection or collection in (".", ".."):
+        raise ValueError(f"Invalid collection name: {collection!r}")
+    return BM25_DIR / f"{collection}.bm25.pkl"
+
+
+def _load(collection: str) -> BM25Index | None:
+    """Load a collection's BM25 index from disk, reusing the cached copy if unchanged."""
+    path = _index_path(collection)
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return None
+
+    cached = _cache.get(collection)
+    if cached and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        with open(path, "rb") as f:
+            index = pickle.load(f)
+    except Exception:
+        # Unreadable cache file: rebuild from Qdrant
+        return None
+    _cache[collection] = (mtime, index)
+    return index
+
+
+def _rebuild(collection: str) -> BM25Index:
+    """Rebuild a collection's index from the token payloads stored in Qdrant."""
+    token_lists: list[list[str]] = []
+    point_ids: list[str] = []
+    offset = None
+    while True:
+        points, offset = qdrant.scroll(
+            collection_name=collection,
+            limit=1000,
+            offset=offset,
+            with_payload=["tokens", "text"],
+            with_vectors=False,
+        )
+        for point in points:
+            payload = point.payload or {}
+            if "text" not in payload:
+                continue
+            token_lists.append(payload.get("tokens") or tokenize(payload["text"]))
+            point_ids.append(str(point.id))
+        if offset is None:
+            break
+
+    index = BM25Index()
+    index.add(token_lists, point_ids)
+    save(collection, index)
+    return index
+
+
+def get(collection: str) -> BM25Index:
+    """A collection's BM25 index: from the cache, from disk, or rebuilt from Qdrant."""
+    with _lock:
+        return _load(collection) or _rebuild(collection)
+
+
+def extend(collection: str, texts: list[str], point_ids: list[str]) -> BM25Index:
+    """
+    Build an extended copy of a collection's BM25 index with the given points.
+    Points already in the index (a re-upload) are not added twice. Nothing is
+    written until save() is called, so a failed upsert leaves no rows.
+    """
+    index = get(collection).copy()
+    new = [(t, pid) for t, pid in zip(texts, point_ids) if pid not in index.rows]
+    if new:
+        index.add([tokenize(t) for t, _ in new], [pid for _, pid in new])
+    return index
+
+
+def save(collection: str, index: BM25Index):
+    """Atomically persist a collection's BM25 index and make it the cached copy."""
+    BM25_DIR.mkdir(parents=True, exist_ok=True)
+    path = _index_path(collection)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+    _cache[collection] = (os.path.getmtime(path), index)
+
+
+def score(collection: str, query_tokens: list[str], point_ids: list[str]) -> np.ndarray | None:
+    """
+    Corpus-wide BM25 scores for the given points. A cached index that is missing
+    some of them is stale and gets rebuilt from Qdrant once; None if they are
+    still missing (e.g. an upload whose upsert is in progress).
+    """
+    index = get(collection)
+    if any(pid not in index.rows for pid in point_ids):
+        with _lock:
+            index = _rebuild(collection)
+        if any(pid not in index.rows for pid in point_ids):
+            return None
+    return index.scores(query_tokens, [index.rows[pid] for pid in point_ids])
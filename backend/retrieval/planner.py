@@ -1,15 +1,43 @@
+import ahocorasick
+
+# Keyword -> route tag (logic from notebook). Matching is substring-based,
+# exactly like the original `kw in q` checks.
+ROUTE_KEYWORDS = [
+    ("api", "code"),
+    ("function", "code"),
+    ("code", "code"),
+    ("how", "faq"),
+    ("faq", "faq"),
+    ("help", "faq"),
+]
+
+# Checked in order: the first tag present wins
+ROUTES = [
+    ("code", ["code_docs", "research_papers"]),
+    ("faq", ["faq_data", "knowledge_base"]),
+]
+
+# Default search sources
+DEFAULT_ROUTE = ["research_papers", "knowledge_base"]
+
+# Compiled once at import so routing is a single pass over the question
+_automaton = ahocorasick.Automaton()
+for keyword, tag in ROUTE_KEYWORDS:
+    _automaton.add_word(keyword, tag)
+_automaton.make_automaton()
+
+
 def planner(question: str) -> list[str]:
     """
     Fast keyword-based selection of Qdrant collections.
     Extracted from the notebook for maximum performance.
     """
-    q = question.lower()
-    
-    # Logic from notebook
-    if "api" in q or "function" in q or "code" in q:
-        return ["code_docs", "research_papers"]
-    if "how" in q or "faq" in q or "help" in q:
-        return ["faq_data", "knowledge_base"]
-    
-    # Default search sources
-    return ["research_papers", "knowledge_base"]
\ No newline at end of file
+    tags = {tag for _, tag in _automaton.iter(question.lower())}
+    if not tags:
+        return list(DEFAULT_ROUTE)
+
+    for tag, collections in ROUTES:
+        if tag in tags:
+            return list(collections)
+
+    return list(DEFAULT_ROUTE)
@@ -1,8 +1,19 @@
 import asyncio
-from rank_bm25 import BM25Okapi
-from core.qdrant_client import qdrant
+import re
+from functools import lru_cache
+
+import numpy as np
+from qdrant_client.models import QuantizationSearchParams, SearchParams
+from core.qdrant_client import async_qdrant
 from core.embeddings import embeddings
 from core.llm import llm
+from retrieval import bm25_index
+
+# Search the INT8 vectors with 2x oversampling, then rescore with the
+# original FP32 vectors so returned scores stay exact
+SEARCH_PARAMS = SearchParams(
+    quantization=QuantizationSearchParams(rescore=True, oversampling=2.0),
+)
 
 COLLECTION_CONFIDENCE = {
     "research_papers": 1.0,
@@ -16,10 +27,35 @@ def dynamic_k(name: str) -> int:
     return 5 if name == "code_docs" else 3
 
 
-def rewrite_query(question: str) -> str:
-    """Use Gemini to rewrite the user question into a better search query."""
-    try:
-        prompt = f"""Rewrite the following question into ONE clear standalone search query.
+_NON_WORD = re.compile(r"\W+")
+
+STOPWORDS = frozenset({
+    "a", "an", "the", "is", "are", "was", "were", "be", "been", "of", "in",
+    "on", "at", "to", "for", "and", "or", "but", "with", "by", "from", "as",
+    "it", "its", "this", "that", "these", "those", "do", "does", "did", "can",
+    "could", "would", "should", "please", "me", "my", "i", "you", "your",
+    "tell", "about", "what", "which", "who", "whom",
+})
+
+
+def normalize_query(question: str) -> str:
+    """Cheap local rewrite: lowercase, strip punctuation and stopwords."""
+    tokens = [t for t in _NON_WORD.split(question.lower()) if t and t not in STOPWORDS]
+    return " ".join(tokens) or question
+
+
+def needs_llm_rewrite(question: str) -> bool:
+    """Only long or non-question inputs are worth a Gemini round trip."""
+    return len(question.split()) > 12 or "?" not in question
+
+
+@lru_cache(maxsize=2048)
+def _llm_rewrite(question: str) -> str:
+    """
+    Gemini rewrite, memoized. Raises on failure so errors and unusable
+    outputs are never cached.
+    """
+    prompt = f"""Rewrite the following question into ONE clear standalone search query.
 
 Return ONLY the rewritten query.
 Do NOT explain.
@@ -27,72 +63,149 @@ Do NOT give options.
 
 Question: {question}
 """
-        response = llm.invoke(prompt)
-        rewritten = response.content.strip()
-        if rewritten and len(rewritten) > 3:
-            return rewritten
+    response = llm.invoke(prompt)
+    rewritten = response.content.strip()
+    if not rewritten or len(rewritten) <= 3:
+        raise ValueError("empty rewrite")
+    return rewritten
+
+
+def rewrite_query(question: str) -> str:
+    """Use Gemini to rewrite the user question into a better search query."""
+    try:
+        return _llm_rewrite(question)
     except Exception:
-        pass
-    return question
+        return question
 
 
-async def retrieve(collection: str, query_vector: list[float]) -> list[tuple[str, float]]:
-    """Retrieve documents from a single Qdrant collection using a pre-computed vector."""
+def _empty_hits() -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    return (
+        np.empty(0, dtype=object),
+        np.empty(0, dtype=object),
+        np.empty(0, dtype=np.float32),
+        np.empty(0, dtype=object),
+    )
+
+
+async def retrieve(
+    collection: str, query_vector: np.ndarray
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Retrieve documents from a single Qdrant collection using a pre-computed vector.
+    Returns parallel arrays of texts, token lists, confidence-weighted scores
+    and point ids.
+    """
     try:
-        results = qdrant.query_points(
+        results = await async_qdrant.query_points(
             collection_name=collection,
             query=query_vector,
             limit=dynamic_k(collection),
+            search_params=SEARCH_PARAMS,
         )
 
+        points = [p for p in results.points if "text" in p.payload]
+        if not points:
+            return _empty_hits()
+
         confidence = COLLECTION_CONFIDENCE.get(collection, 1.0)
-        return [
-            (point.payload["text"], point.score * confidence)
-            for point in results.points
-            if "text" in point.payload
-        ]
+        texts = np.array([p.payload["text"] for p in points], dtype=object)
+        # Filled element-wise so NumPy keeps one list per slot instead of a 2-D array
+        tokens = np.empty(len(points), dtype=object)
+        for i, p in enumerate(points):
+            tokens[i] = p.payload.get("tokens") or bm25_index.tokenize(p.payload["text"])
+        scores = np.array([p.score for p in points], dtype=np.float32) * confidence
+        point_ids = np.array([str(p.id) for p in points], dtype=object)
+        return texts, tokens, scores, point_ids
     except Exception:
-        return []
+        return _empty_hits()
 
 
-async def hybrid_retrieve(query: str, selected: list[str]) -> list[str]:
+def corpus_bm25_scores(
+    collections: np.ndarray, point_ids: np.ndarray, query_tokens: list[str]
+) -> np.ndarray | None:
+    """
+    Score hits against their collection-wide BM25 index (rebuilt from Qdrant
+    if needed); None if any hit is not indexed yet.
+    """
+    scores = np.zeros(len(point_ids), dtype=np.float32)
+    for collection in np.unique(collections):
+        mask = collections == collection
+        col_scores = bm25_index.score(collection, query_tokens, point_ids[mask].tolist())
+        if col_scores is None:
+            return None
+        scores[mask] = col_scores
+    return scores
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the k highest scores, best first, without a full sort."""
+    if len(scores) > k:
+        # Sorted so ties keep their original order under the stable argsort
+        idx = np.sort(np.argpartition(-scores, k - 1)[:k])
+    else:
+        idx = np.arange(len(scores))
+    return idx[np.argsort(-scores[idx], kind="stable")]
+
+
+async def hybrid_retrieve(
+    query: str, selected: list[str], question_vec: np.ndarray | None = None
+) -> list[str]:
     """
     Optimized Hybrid retrieval: single embedding call, parallel search, and BM25 reranking.
+    Pass question_vec (the embedding of `query`) to reuse a vector the caller already has.
     """
-    # Step 1: Rewrite query for better retrieval
-    rewritten = rewrite_query(query)
-
-    # Step 2: Pre-compute embedding once for all collections (Huge Speedup)
-    query_vector = embeddings.embed_query(rewritten)
+    # Step 1: Rewrite query — Gemini (memoized) only for long or ambiguous inputs.
+    # Local normalization of short questions only feeds the BM25 tokens.
+    llm_rewritten = needs_llm_rewrite(query)
+    if llm_rewritten:
+        rewritten = rewrite_query(query)
+    else:
+        rewritten = normalize_query(query)
+
+    # Step 2: Pre-compute embedding once for all collections (Huge Speedup).
+    # The vector search embeds the raw question unless Gemini rewrote it, and
+    # the caller's vector is reused when it embeds the same text.
+    search_text = rewritten if llm_rewritten else query
+    if question_vec is not None and search_text == query:
+        query_vector = question_vec
+    else:
+        query_vector = embeddings.encode_query(search_text)
 
     # Step 3: Parallel retrieval from selected collections using the SAME vector
     tasks = [retrieve(c, query_vector) for c in selected]
     results = await asyncio.gather(*tasks)
 
-    # Step 4: Merge and sort
-    merged = []
-    for r in results:
-        merged.extend(r)
-
-    if not merged:
+    # Step 4: Merge and select the top candidates in O(N)
+    all_texts = np.concatenate([r[0] for r in results])
+    if len(all_texts) == 0:
         return []
+    all_tokens = np.concatenate([r[1] for r in results])
+    all_scores = np.concatenate([r[2] for r in results])
+    all_point_ids = np.concatenate([r[3] for r in results])
+    all_collections = np.repeat(
+        np.array(selected, dtype=object), [len(r[0]) for r in results]
+    )
 
-    merged.sort(key=lambda x: x[1], reverse=True)
-    
     # Increased to 15 for deep context synthesis
-    top_vector_docs = [doc for doc, score in merged[:15]]
+    idx = top_k_indices(all_scores, 15)
+    top_vector_docs = all_texts[idx].tolist()
 
     if len(top_vector_docs) < 2:
         return top_vector_docs
 
     # Step 5: BM25 reranking for better relevance
     try:
-        tokenized_docs = [doc.split() for doc in top_vector_docs]
-        bm25 = BM25Okapi(tokenized_docs)
-        scores = bm25.get_scores(rewritten.split())
-        combined = list(zip(top_vector_docs, scores))
-        combined.sort(key=lambda x: x[1], reverse=True)
+        query_tokens = bm25_index.tokenize(rewritten)
+        # Off the event loop: a missing or stale index is rebuilt from Qdrant
+        scores = await asyncio.to_thread(
+            corpus_bm25_scores, all_collections[idx], all_point_ids[idx], query_tokens
+        )
+        if scores is None:
+            # Points not in the BM25 index yet: score the candidates alone
+            bm25 = bm25_index.BM25Index.from_tokens(all_tokens[idx].tolist())
+            scores = bm25.scores(query_tokens)
         # Finalized to top 10 for professional summaries
-        return [doc for doc, score in combined[:10]]
+        order = top_k_indices(np.asarray(scores, dtype=np.float32), 10)
+        return [top_vector_docs[i] for i in order]
     except Exception:
-        return top_vector_docs[:10]
\ No newline at end of file
+        return top_vector_docs[:10]